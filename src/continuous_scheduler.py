@@ -18,7 +18,7 @@
 # ---------------------------------------------------------------------------- #
 
 import sched
-from time import sleep, time
+from time import monotonic, sleep
 
 # ---------------------------------------------------------------------------- #
 
@@ -36,16 +36,20 @@ class TaskWrapper(object):
     # ------------------------------------------------------------------------ #
 
     def __call__(self, *args, **kwargs):
-        self._task(*self._args, **self._kwargs)
+        # The next run is scheduled before executing the task, so that the
+        # period does not drift by the duration of the task
         self._scheduler.enter(self._period, self._priority, self, *self._args,
                               **self._kwargs)
+        self._task(*self._args, **self._kwargs)
 
 # ---------------------------------------------------------------------------- #
 
 class MainScheduler(object):
 
     def __init__(self):
-        self._scheduler = sched.scheduler(time, sleep)
+        # The scheduler sleeps until the next event is due. The monotonic clock
+        # keeps the waits unaffected by changes of the system time.
+        self._scheduler = sched.scheduler(monotonic, sleep)
 
     # ------------------------------------------------------------------------ #
 
@@ -21,9 +21,10 @@
 import argparse
 import configparser
 import logging
+import os
 import sys
-from influxdb import DataFrameClient
-from time import time
+from functools import lru_cache
+from time import monotonic_ns
 
 import reporting
 import continuous_scheduler
@@ -43,9 +44,31 @@ WEB_SERVER_URL = 'https://tdm-or5.jicsardegna.it/get_report'
 SQLITE_DB = '/sqlite_db/reporting.db'
 SQLITE_DB_TABLE = 'report_requests'
 REPORTING_INTERVAL = 60*60*24
+NESTED_REPORT_DATA = False         # Send data as JSON object, not as string
+COMPRESS_REPORT_REQUEST = False    # Gzip the body of the report request
 
 APPLICATION_NAME = 'Energy_Consumption_Report'
 
+_GENERAL_CONFIG_DEFAULTS = {'logging_level': logging.INFO,
+                            'influxdb_host': INFLUXDB_HOST,
+                            'influxdb_port': INFLUXDB_PORT,
+                            'influxdb_database': INFLUXDB_DB,
+                            'influxdb_username': INFLUXDB_USER,
+                            'influxdb_password': INFLUXDB_PASS,
+                            'gps_location': GPS_LOCATION}
+
+_SPECIFIC_CONFIG_DEFAULTS = {'measurement_ts': MEASUREMENT_TS,
+                             'email_address': EMAIL_ADDRESS,
+                             'web_server_url': WEB_SERVER_URL,
+                             'sqlite_db': SQLITE_DB,
+                             'sqlite_db_table': SQLITE_DB_TABLE,
+                             'reporting_interval': REPORTING_INTERVAL,
+                             'nested_report_data': NESTED_REPORT_DATA,
+                             'compress_report_request': COMPRESS_REPORT_REQUEST}
+
+_BOOL_MAP = {'false': False, 'f': False, '0': False, 'no': False, 'n': False,
+             'true': True, 't': True, '1': True, 'yes': True, 'y': True}
+
 # ---------------------------------------------------------------------------- #
 
 def str_to_bool(parameter):
@@ -54,61 +77,84 @@ def str_to_bool(parameter):
     """
     if isinstance(parameter, bool):
         return parameter
-    if parameter.lower() in {'false', 'f', '0', 'no', 'n'}:
-        return False
-    elif parameter.lower() in {'true', 't', '1', 'yes', 'y'}:
-        return True
-    raise ValueError(f'"{parameter}" is not a valid boolean value.')
+    value = _BOOL_MAP.get(parameter.lower())
+    if value is None:
+        raise ValueError(f'"{parameter}" is not a valid boolean value.')
+    return value
+
+# ---------------------------------------------------------------------------- #
+
+def _parse_config(config_source):
+    """
+    Parse the configuration, given as file name or as file-like object, and
+    return the options read from the GENERAL and the application specific
+    sections, merged with their defaults.
+    """
+    _config = configparser.ConfigParser()
+    _config.read_dict({'GENERAL': _GENERAL_CONFIG_DEFAULTS,
+                       APPLICATION_NAME: _SPECIFIC_CONFIG_DEFAULTS})
+    if isinstance(config_source, str):
+        _config.read(config_source)
+    else:
+        _config.read_file(config_source)
+
+    # Filter out GENERAL options not listed in _GENERAL_CONFIG_DEFAULTS
+    _general_defaults = {_key: _config.get('GENERAL', _key) for _key in
+                         _config.options('GENERAL') if _key in
+                         _GENERAL_CONFIG_DEFAULTS}
+
+    # Updates the defaults dictionary with general and application specific
+    # options
+    v_config_defaults = {}
+    v_config_defaults.update(_general_defaults)
+    v_config_defaults.update(_config.items(APPLICATION_NAME))
+
+    return v_config_defaults
+
+# ---------------------------------------------------------------------------- #
+
+@lru_cache(maxsize=4)
+def _load_config(config_file, version):
+    """
+    Parse the configuration file, see "_parse_config". The "version" argument
+    is only used as cache key.
+    """
+    return _parse_config(config_file)
 
 # ---------------------------------------------------------------------------- #
 
-def configuration_parser(p_args=None):
+def configuration_parser(p_args=None, config_stream=None):
+    """
+    Parse the configuration file and the command line options. If the config
+    file is "-", the configuration is read from "config_stream", defaulting to
+    the standard input.
+    """
     pre_parser = argparse.ArgumentParser(add_help=False)
 
     pre_parser.add_argument(
         '-c', '--config-file', dest='config_file', action='store',
         type=str, metavar='FILE',
-        help='specify the config file')
+        help='specify the config file ("-" for the standard input)')
 
     args, remaining_args = pre_parser.parse_known_args(p_args)
 
-    v_general_config_defaults = {'logging_level': logging.INFO,
-                                 'influxdb_host': INFLUXDB_HOST,
-                                 'influxdb_port': INFLUXDB_PORT,
-                                 'influxdb_database': INFLUXDB_DB,
-                                 'influxdb_username': INFLUXDB_USER,
-                                 'influxdb_password': INFLUXDB_PASS,
-                                 'gps_location': GPS_LOCATION}
-
-    v_specific_config_defaults = {'measurement_ts': MEASUREMENT_TS,
-                                  'email_address': EMAIL_ADDRESS,
-                                  'web_server_url': WEB_SERVER_URL,
-                                  'sqlite_db': SQLITE_DB,
-                                  'sqlite_db_table': SQLITE_DB_TABLE,
-                                  'reporting_interval': REPORTING_INTERVAL}
-
-    v_config_section_defaults = {'GENERAL': v_general_config_defaults,
-                                 APPLICATION_NAME: v_specific_config_defaults}
-
     # Default config values initialization
     v_config_defaults = {}
-    v_config_defaults.update(v_general_config_defaults)
-    v_config_defaults.update(v_specific_config_defaults)
-
-    if args.config_file:
-        _config = configparser.ConfigParser()
-        _config.read_dict(v_config_section_defaults)
-        _config.read(args.config_file)
-
-        # Filter out GENERAL options not listed in v_general_config_defaults
-        _general_defaults = {_key: _config.get('GENERAL', _key) for _key in
-                             _config.options('GENERAL') if _key in
-                             v_general_config_defaults}
+    v_config_defaults.update(_GENERAL_CONFIG_DEFAULTS)
+    v_config_defaults.update(_SPECIFIC_CONFIG_DEFAULTS)
+
+    if args.config_file == '-':
+        v_config_defaults.update(_parse_config(config_stream or sys.stdin))
+    elif args.config_file:
+        # Modification time and size of the file make the cached options
+        # expire when the configuration file changes
+        try:
+            _stat = os.stat(args.config_file)
+            _version = (_stat.st_mtime_ns, _stat.st_size)
+        except OSError:
+            _version = None
 
-        # Updates the defaults dictionary with general and application specific
-        # options
-        v_config_defaults.update(_general_defaults)
-        v_config_defaults.update(_config.items(APPLICATION_NAME))
+        v_config_defaults.update(_load_config(args.config_file, _version))
 
     parser = argparse.ArgumentParser(parents=[pre_parser],
                           description=('Read pulse measurements from InfluxDB '
@@ -178,6 +224,20 @@ def configuration_parser(p_args=None):
         help=('frequency, in seconds, between consecutive report requests '
               '(default: {} seconds)').format(REPORTING_INTERVAL))
 
+    parser.add_argument(
+        '--nested-report-data', dest='nested_report_data', action='store',
+        type=str_to_bool,
+        help=('send the measurements to the web service as a nested JSON '
+              'object instead of a JSON string; requires a compatible web '
+              'service (default: {})').format(NESTED_REPORT_DATA))
+
+    parser.add_argument(
+        '--compress-report-request', dest='compress_report_request',
+        action='store', type=str_to_bool,
+        help=('compress the body of the report request with gzip; requires a '
+              'compatible web service (default: {})')
+              .format(COMPRESS_REPORT_REQUEST))
+
     return parser.parse_args(remaining_args)
 
 # ---------------------------------------------------------------------------- #
@@ -186,26 +246,26 @@ def reporting_task(params: dict):
 
     logger = params['LOGGER']
     logger.info('Starting reporting task...')
-    start_time = time()
+    start_time = monotonic_ns()
 
     # Create SQLite table, if necessary
     reporting.create_sqlite_table(params)
 
+    # The report includes measurements up to the last day of the previous month
+    month_start, month_end = reporting.get_previous_month_bounds()
+
     # Check whether the email has been successfully sent for the previous month
-    report_received, previous_month_date = reporting.check_report_status(params)
+    report_received, previous_month_date = \
+        reporting.check_report_status(params, month_start)
 
     # Send the data and request a report if it has not been received yet
     if not report_received:
 
-        # Connect to the database "Emon" in InfluxDB
-        client = DataFrameClient(host=params['INFLUXDB_HOST'],
-                                 port=params['INFLUXDB_PORT'],
-                                 username=params['INFLUXDB_USER'],
-                                 password=params['INFLUXDB_PASS'],
-                                 database=params['INFLUXDB_DB'])
+        # Check if "Emon" database exists, creating it if necessary
+        reporting.check_influx_database(params)
 
-        # Query and preprocess power load measurements
-        y = reporting.preprocessing(client, params)
+        # Query and preprocess power load measurements of the previous month
+        y = reporting.preprocessing(params, month_start, month_end)
 
         try:
             # Send the data to the TDM server
@@ -223,8 +283,7 @@ def reporting_task(params: dict):
             logger.error(e)
         finally:
             logger.info('Reporting task completed in '
-                        f'{round(time()-start_time)} seconds!')
-            client.close()
+                        f'{(monotonic_ns() - start_time) // 1_000_000} ms!')
     else:
         logger.info(f'The report for month "{previous_month_date}" '
                     'had been already sent.')
@@ -260,22 +319,6 @@ def main():
     v_influxdb_username = args.influxdb_username
     v_influxdb_password = args.influxdb_password
 
-    # Check if "Emon" database exists
-    _client = DataFrameClient(host=v_influxdb_host,
-                              port=v_influxdb_port,
-                              username=v_influxdb_username,
-                              password=v_influxdb_password,
-                              database=v_influxdb_database)
-
-    _dbs = _client.get_list_database()
-    logger.debug(f'List of InfluxDB databases: {_dbs}')
-    if v_influxdb_database not in [_d['name'] for _d in _dbs]:
-        logger.info(f'InfluxDB database "{v_influxdb_database}" not found. '
-                    'Creating a new one.')
-        _client.create_database(v_influxdb_database)
-
-    _client.close()
-
     # Pack all parameters in a dictionary
     _userdata = {'LOGGER': logger,
                  'LATITUDE': v_latitude,
@@ -290,10 +333,13 @@ def main():
                  'WEB_SERVER_URL': args.web_server_url,
                  'SQLITE_DB': args.sqlite_db,
                  'SQLITE_DB_TABLE': args.sqlite_db_table,
-                 'REPORTING_INTERVAL': args.reporting_interval}
+                 'REPORTING_INTERVAL': args.reporting_interval,
+                 'NESTED_REPORT_DATA': args.nested_report_data,
+                 'COMPRESS_REPORT_REQUEST': args.compress_report_request}
 
     # Instantiate the scheduler and repeatedly run the "reporting task"
-    # 24 hours after its previous execution
+    # every "reporting_interval" seconds, counted from the start of its
+    # previous execution so that the schedule does not drift
     _main_scheduler = continuous_scheduler.MainScheduler()
     _main_scheduler.add_task(reporting_task, 0, args.reporting_interval, 0,
                              _userdata)
@@ -18,85 +18,272 @@
 
 # ---------------------------------------------------------------------------- #
 
+from __future__ import annotations
+
+import atexit
+import csv
+import gzip
 import json
-import pandas as pd
-import requests
 import sqlite3
-from datetime import date, timedelta
-from influxdb import DataFrameClient
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 from sys import exit
+from typing import TYPE_CHECKING
+
+# pandas and requests are imported when first needed, so that they do not
+# slow down the startup of the application
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
+
+# ---------------------------------------------------------------------------- #
+
+# SQL statements on the report requests table. Using always the same strings
+# lets sqlite3 reuse its cached prepared statements across reporting tasks.
+_SQL_CREATE = ('CREATE TABLE IF NOT EXISTS {table} '
+               '(timestamp TEXT, response INTEGER)')
+_SQL_INDEX = ('CREATE INDEX IF NOT EXISTS idx_{table}_ts_resp '
+              'ON {table} (timestamp, response)')
+_SQL_SELECT = 'SELECT 1 FROM {table} WHERE timestamp=? AND response=? LIMIT 1'
+_SQL_INSERT = 'INSERT INTO {table} (timestamp, response) VALUES (?,?)'
+
+# Set to True once the report requests table and its index have been created
+_TABLE_READY = False
+
+# Set to True once the existence of the InfluxDB database has been checked
+_DB_CHECKED = False
 
 # ---------------------------------------------------------------------------- #
 
-def get_first_timestamp(client: DataFrameClient, field_name: str,
-                        measurement_name: str, dt: bool = False) -> str:
+@lru_cache(maxsize=1)
+def _get_conn(sqlite_db: str) -> sqlite3.Connection:
     """
-    Return the timestamp corresponding to the first data point of "field" from
-    "measurement" as a "datetime" or as a "string".
+    Return the connection to the SQLite database, opening it on first use.
     """
 
-    q = client.query(f"""
-                         SELECT "{field_name}"
-                         FROM "{measurement_name}"
-                         LIMIT 1;
-                      """)[measurement_name].index[0]
-    if dt:
-        return q
-    else:
-        return str(q)[:19]
+    connection = sqlite3.connect(sqlite_db)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    atexit.register(connection.close)
+    return connection
 
 # ---------------------------------------------------------------------------- #
 
-def preprocessing(client: DataFrameClient, params: dict) -> pd.DataFrame:
+# Query estimating the power consumption from the "pulse" time series of
+# measurement "m" between times "s" (included) and "e" (excluded). Negative
+# values and outliers are removed and the hourly mean of power absorption, i.e.
+# energy consumption in kWh, is computed by InfluxDB. The inner query starts one
+# hour earlier, so that the derivative is also available for the first hour.
+_POWER_QUERY_TMPL = """
+    SELECT MEAN(power) AS power FROM (
+              SELECT NON_NEGATIVE_DERIVATIVE(MEDIAN(pulse), 1h) as power
+              FROM "{m}"
+              WHERE time >= '{s}' - 1h AND time < '{e}'
+              GROUP BY time(1h)
+              FILL(null))
+    WHERE time >= '{s}' AND time < '{e}' AND power >= 0 AND power < 15000
+    GROUP BY time(1h)
+    FILL(null);
     """
-    Query EmonTx measurements from InfluxDB and prepare the dataframe containing
-    the hourly-averaged power load measurements.
+
+# ---------------------------------------------------------------------------- #
+
+def _new_session(scheme: str, pool_maxsize: int) -> requests.Session:
+    """
+    Return a new HTTP session keeping the connections to the given scheme
+    alive and retrying on connection failures.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.mount(scheme, HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=pool_maxsize,
+                                      max_retries=Retry(total=3,
+                                                        backoff_factor=0.5)))
+    return session
+
+# ---------------------------------------------------------------------------- #
+
+@lru_cache(maxsize=1)
+def _get_influx_session() -> requests.Session:
+    """
+    Return the HTTP session for the InfluxDB queries, shared by all the
+    reporting tasks. Results are requested as plain CSV.
+    """
+
+    session = _new_session('http://', 1)
+    session.headers.update({'Accept': 'application/csv',
+                            'Accept-Encoding': 'identity'})
+    return session
+
+# ---------------------------------------------------------------------------- #
+
+@lru_cache(maxsize=1)
+def _get_session() -> requests.Session:
+    """
+    Return the HTTP session for the requests to the TDM server.
+    """
+
+    return _new_session('https://', 2)
+
+# ---------------------------------------------------------------------------- #
+
+def _influx_url(params: dict) -> str:
+    """
+    Return the URL of the query endpoint of InfluxDB.
+    """
+
+    return f"http://{params['INFLUXDB_HOST']}:{params['INFLUXDB_PORT']}/query"
+
+# ---------------------------------------------------------------------------- #
+
+def _query_csv(params: dict, q: str) -> dict:
+    """
+    Run the InfluxQL query "q" and return a dictionary mapping the name of each
+    measurement in the result to the dataframe of its time-indexed values.
+    The response is streamed, so parsing starts while data is still received.
+    Raise RuntimeError with the message of InfluxDB if the query fails.
+    """
+
+    import pandas as pd
+
+    response = _get_influx_session().get(_influx_url(params),
+                                         params={'db': params['INFLUXDB_DB'],
+                                                 'u': params['INFLUXDB_USER'],
+                                                 'p': params['INFLUXDB_PASS'],
+                                                 'q': q,
+                                                 'epoch': 'ms'},
+                                         stream=True)
+
+    with response:
+        response.raise_for_status()
+
+        try:
+            # Tag columns are not used: skip them while parsing
+            df = pd.read_csv(response.raw,
+                             usecols=lambda _col: _col != 'tags')
+        except pd.errors.EmptyDataError:
+            return {}
+
+    # Statement errors are returned with status code 200 as an "error" column
+    if 'error' in df.columns:
+        raise RuntimeError(f'InfluxDB query failed: {df["error"].iloc[0]}')
+
+    df = df.set_index('time')
+    df.index = pd.to_datetime(df.index, unit='ms', utc=True)
+
+    return {_name: _df.drop(columns='name')
+            for _name, _df in df.groupby('name', sort=False)}
+
+# ---------------------------------------------------------------------------- #
+
+def check_influx_database(params: dict):
     """
+    Create the InfluxDB database, if it does not exist yet. The check is done
+    only once per process.
+    """
+
+    global _DB_CHECKED
+
+    if _DB_CHECKED:
+        return
 
     logger = params['LOGGER']
-    measurement_ts = params['MEASUREMENT_TS']
+    database = params['INFLUXDB_DB']
+    session = _get_influx_session()
+    credentials = {'u': params['INFLUXDB_USER'], 'p': params['INFLUXDB_PASS']}
 
-    # ------------------------------------------------------------------------ #
+    response = session.get(_influx_url(params),
+                           params={**credentials, 'q': 'SHOW DATABASES'})
+    response.raise_for_status()
+
+    _rows = list(csv.reader(response.text.splitlines()))
+
+    # Statement errors are returned with status code 200 as an "error" column
+    if _rows and 'error' in _rows[0]:
+        raise RuntimeError('InfluxDB query failed: '
+                           f'{_rows[1][_rows[0].index("error")]}')
+
+    # The last column of the CSV result holds the database names
+    _dbs = [_row[-1] for _row in _rows[1:]]
+    logger.debug(f'List of InfluxDB databases: {_dbs}')
+
+    if database not in _dbs:
+        logger.info(f'InfluxDB database "{database}" not found. '
+                    'Creating a new one.')
+        response = session.post(_influx_url(params),
+                                params={**credentials,
+                                        'q': f'CREATE DATABASE "{database}"'})
+        response.raise_for_status()
+
+    _DB_CHECKED = True
+
+# ---------------------------------------------------------------------------- #
+
+def get_previous_month_bounds() -> (date, date):
+    """
+    Return the first day of the previous month and the first day of the
+    current month, i.e. the bounds of the period covered by the report.
+    """
+
+    month_end = date.today().replace(day=1)
+    month_start = (month_end - timedelta(days=1)).replace(day=1)
+
+    return (month_start, month_end)
+
+# ---------------------------------------------------------------------------- #
+
+def _local_midnight_utc(day: date) -> str:
+    """
+    Return the local midnight of "day" as an UTC timestamp for InfluxQL.
+    """
+
+    midnight = datetime.combine(day, datetime.min.time()).astimezone()
+    return f'{midnight.astimezone(timezone.utc):%Y-%m-%dT%H:%M:%SZ}'
+
+# ---------------------------------------------------------------------------- #
+
+def preprocessing(params: dict, month_start: date,
+                  month_end: date) -> pd.DataFrame:
+    """
+    Query EmonTx measurements from InfluxDB and prepare the dataframe containing
+    the hourly-averaged power load measurements between "month_start"
+    (included) and "month_end" (excluded).
+    """
 
-    # Get timestamp of earlier pulse measurement
-    first_timestamp = get_first_timestamp(client=client,
-                                          field_name='pulse',
-                                          measurement_name=measurement_ts)
+    logger = params['LOGGER']
+    measurement_ts = params['MEASUREMENT_TS']
 
-    logger.debug(f'Earliest timestamp in "{measurement_ts}" '
-                 f'time series: {first_timestamp}')
+    # The month bounds are local dates, while InfluxDB works in UTC
+    start_time = _local_midnight_utc(month_start)
+    end_time = _local_midnight_utc(month_end)
 
     # ------------------------------------------------------------------------ #
 
     # Query and estimate power consumption from the "pulse" time series
-    query = f"""
-            SELECT * FROM (
-                      SELECT NON_NEGATIVE_DERIVATIVE(MEDIAN(pulse), 1h) as power
-                      FROM "{measurement_ts}"
-                      WHERE time >= '{first_timestamp}'
-                      GROUP BY time(1h)
-                      FILL(null))
-            WHERE power < 15000;
-            """
+    query = _POWER_QUERY_TMPL.format(m=measurement_ts, s=start_time,
+                                     e=end_time)
     logger.debug(f'Querying field "power" from measurement "{measurement_ts}"...')
 
     try:
         # Query power consumption data
-        y = client.query(query)[measurement_ts]
+        y = _query_csv(params, query)[measurement_ts]
         logger.debug(f'Retrieved {y.shape[0]} measurements.')
-
-        # Remove negative power values and outliers
-        y = y[(y >= 0) & (y < 15000)]
-
-        # Compute hourly mean of power absorption, i.e. energy consumption in kWh
-        y = y.resample('1h').mean()
         logger.debug(f'Head of "y" time series: {y.head()}')
 
-    except KeyError as e:
+    except KeyError:
+        logger.error(f'No data found in measurement "{measurement_ts}" '
+                     f'between {start_time} and {end_time}.')
+        exit(0)
+
+    except RuntimeError as e:
         logger.error(e)
         exit(0)
 
-    if y.size < 2:
+    # Hours without valid measurements are returned as null by InfluxDB
+    if y['power'].count() < 2:
         logger.error(('A larger number of valid measurements is requested for '
                       'computing the power load forecasts.'))
         exit(0)
@@ -114,60 +301,78 @@ def sending(y: pd.DataFrame, params: dict):
     url = params['WEB_SERVER_URL']
     email_address = params['EMAIL_ADDRESS']
 
-    # Create body and headers of request
-    body = json.dumps({'data': y.to_json(),
+    # Create body and headers of request. If supported by the web service, the
+    # JSON document produced by pandas is embedded as a nested object rather
+    # than as an escaped string.
+    data = y.to_json()
+    if params['NESTED_REPORT_DATA']:
+        data = json.loads(data)
+    body = json.dumps({'data': data,
                        'email_address': email_address})
     headers = {'Content-Type': 'application/json'}
 
+    # If supported by the web service, compress the body, mostly made of
+    # repeated keys and timestamps
+    if params['COMPRESS_REPORT_REQUEST']:
+        headers['Content-Encoding'] = 'gzip'
+        data = gzip.compress(body.encode(), compresslevel=6)
+        logger.debug(f'Request body compressed from {len(body)} to '
+                     f'{len(data)} bytes.')
+    else:
+        data = body
+
     # Send HTTP post request
     logger.debug('Sending data to TDM server...')
-    return requests.post(url, headers=headers, data=body, verify=False)
+    return _get_session().post(url, headers=headers, data=data, verify=False)
 
 # ---------------------------------------------------------------------------- #
 
 def create_sqlite_table(params: dict):
     """
-    Function for creating the table for storing the report requests.
+    Function for creating the table for storing the report requests, if it
+    does not exist yet.
     """
 
+    global _TABLE_READY
+
+    if _TABLE_READY:
+        return
+
     logger = params['LOGGER']
     table_name = params['SQLITE_DB_TABLE']
 
     try:
-        with sqlite3.connect(params['SQLITE_DB']) as connection:
-            cursor = connection.cursor()
-            cursor.execute(f"""CREATE TABLE {table_name} (timestamp TEXT,
-                                                          response INTEGER)""")
+        with _get_conn(params['SQLITE_DB']) as connection:
+            connection.execute(_SQL_CREATE.format(table=table_name))
+            connection.execute(_SQL_INDEX.format(table=table_name))
+        _TABLE_READY = True
     except sqlite3.OperationalError as e:
-        logger.debug(f'Impossibile creare la tabella "{table_name}": "{e}"')
+        logger.error(f'Impossibile creare la tabella "{table_name}": "{e}"')
 
 # ---------------------------------------------------------------------------- #
 
-def check_report_status(params: dict) -> (bool, str):
+def check_report_status(params: dict, month_start: date) -> (bool, str):
     """
     Function to check whether a user has already requested the report for the
-    specified month.
+    month starting on "month_start".
     """
 
     logger = params['LOGGER']
     table_name = params['SQLITE_DB_TABLE']
-    today_date = date.today()
 
-    # Set date to include measurements up to the last day of the previous month
-    previous_month_date = date(today_date.year, today_date.month, day=1) - \
-                               timedelta(days=1)
+    timestamp = f'{month_start.year}-{month_start.month:02d}'
+    report_received = False
 
     try:
-        with sqlite3.connect(params['SQLITE_DB']) as connection:
-            cursor = connection.cursor()
-            cursor.execute(f"""SELECT * FROM {table_name}""")
-            records = cursor.fetchall()
+        with _get_conn(params['SQLITE_DB']) as connection:
+            cursor = connection.execute(_SQL_SELECT.format(table=table_name),
+                                        (timestamp, 200))
+            report_received = cursor.fetchone() is not None
     except Exception as e:
         logger.error('Impossibile leggere i record dalla tabella '
                      f'"{table_name}": "{e}"')
 
-    timestamp = f'{previous_month_date.year}-{previous_month_date.month:02d}'
-    return ((timestamp, 200) in records, timestamp)
+    return (report_received, timestamp)
 
 # ---------------------------------------------------------------------------- #
 
@@ -176,22 +381,31 @@ def update_sqlite_db(params: dict, timestamp: str, status_code: int):
     Update the table of the SQLite database when a report is sent successfully.
     """
 
+    update_sqlite_db_many(params, [(timestamp, status_code)])
+
+# ---------------------------------------------------------------------------- #
+
+def update_sqlite_db_many(params: dict, records):
+    """
+    Insert several (timestamp, status_code) records in the table of the SQLite
+    database within a single transaction, e.g. when backfilling past months.
+    """
+
     logger = params['LOGGER']
     table_name = params['SQLITE_DB_TABLE']
+    records = list(records)
 
-    try:
+    connection = _get_conn(params['SQLITE_DB'])
 
-        with sqlite3.connect(params['SQLITE_DB']) as connection:
-            cursor = connection.cursor()
-            cursor.execute("""INSERT INTO report_requests (timestamp, response)
-                              VALUES (?,?)""", (timestamp, status_code))
+    try:
+        with connection:
+            connection.executemany(_SQL_INSERT.format(table=table_name),
+                                   records)
 
-            connection.commit()
-            logger.debug(f'Record ({timestamp}, {status_code}) successfully '
-                         f'inserted in table "{table_name}"')
+            logger.debug(f'Records {records} successfully inserted in table '
+                         f'"{table_name}"')
     except Exception as e:
-        connection.rollback()
-        logger.error(f'Could not insert record ({timestamp}, {status_code}) '
-                     f'into table "{table_name}": "{e}"')
+        logger.error(f'Could not insert records {records} into table '
+                     f'"{table_name}": "{e}"')
 
 # ---------------------------------------------------------------------------- #
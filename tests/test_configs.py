@@ -27,10 +27,13 @@ This module tests:
 
 # ---------------------------------------------------------------------------- #
 
+import io
 import logging
 import os
+import tempfile
 import unittest
-from unittest.mock import Mock
+from functools import lru_cache
+from types import SimpleNamespace
 
 from energy_consumption_report import configuration_parser
 from energy_consumption_report import APPLICATION_NAME
@@ -45,6 +48,37 @@ COMMANDLINE_PARAMETERS = {'logging_level': {'cmdline': '--logging-level',
                           'influxdb_port': {'cmdline': '--influxdb-port',
                                             'default': INFLUXDB_PORT}}
 
+_TEST_OPTIONS = SimpleNamespace(influxdb_host='influxdb_host_option',
+                                influxdb_port=INFLUXDB_PORT + 10,
+                                logging_level=logging.INFO + 10)
+
+_TEST_CONFIGURATION = SimpleNamespace(
+    influxdb_host='influxdb_host_configuration',
+    influxdb_port=INFLUXDB_PORT + 20,
+    logging_level=logging.INFO + 20)
+
+_DEFAULT = SimpleNamespace(influxdb_host=INFLUXDB_HOST,
+                           influxdb_port=INFLUXDB_PORT,
+                           logging_level=logging.INFO)
+
+_TEST = SimpleNamespace(influxdb_host='influxdb_host_test',
+                        influxdb_port=INFLUXDB_PORT + 100,
+                        logging_level=logging.INFO + 10)
+
+_OVERRIDE = SimpleNamespace(influxdb_host='influxdb_host_override',
+                            influxdb_port=INFLUXDB_PORT + 200,
+                            logging_level=logging.INFO + 20)
+
+# ---------------------------------------------------------------------------- #
+
+@lru_cache(maxsize=8)
+def _cached_parse(p_args):
+    """
+    Memoized "configuration_parser" for the tests that only read the returned
+    namespace. The command line is passed as a tuple.
+    """
+    return configuration_parser(list(p_args))
+
 # ---------------------------------------------------------------------------- #
 
 class TestCommandLineParser(unittest.TestCase):
@@ -53,28 +87,17 @@ class TestCommandLineParser(unittest.TestCase):
     configuration file.
     """
 
-    def setUp(self):
-        self._test_options = Mock()
-        self._test_options.influxdb_host = 'influxdb_host_option'
-        self._test_options.influxdb_port = INFLUXDB_PORT + 10
-        self._test_options.logging_level = logging.INFO + 10
-
-        self._test_configuration = Mock()
-        self._test_configuration.influxdb_host = 'influxdb_host_configuration'
-        self._test_configuration.influxdb_port = INFLUXDB_PORT + 20
-        self._test_configuration.logging_level = logging.INFO + 20
-
-        self._config_file = '/tmp/config.ini'
-
-        _f = open(self._config_file, "w")
-        _f.write("[{:s}]\n".format(APPLICATION_NAME))
-        _f.write("influxdb_host = {}\n".format(
-            self._test_configuration.influxdb_host))
-        _f.write("influxdb_port = {}\n".format(
-            self._test_configuration.influxdb_port))
-        _f.write("logging_level = {}\n".format(
-            self._test_configuration.logging_level))
-        _f.close()
+    @classmethod
+    def setUpClass(cls):
+        cls._base_cmd = ['--influxdb-host', _TEST_OPTIONS.influxdb_host,
+                         '--influxdb-port', str(_TEST_OPTIONS.influxdb_port),
+                         '--logging-level', str(_TEST_OPTIONS.logging_level)]
+
+        cls._config_text = (
+            f"[{APPLICATION_NAME}]\n"
+            f"influxdb_host = {_TEST_CONFIGURATION.influxdb_host}\n"
+            f"influxdb_port = {_TEST_CONFIGURATION.influxdb_port}\n"
+            f"logging_level = {_TEST_CONFIGURATION.logging_level}\n")
 
     # ------------------------------------------------------------------------ #
 
@@ -82,24 +105,16 @@ class TestCommandLineParser(unittest.TestCase):
         """"
         Tests if the command line options are parsed.
         """
-        _cmd_line = []
-
-        _cmd_line.extend(['--config-file', None])
-        _cmd_line.extend(
-            ['--influxdb-host', str(self._test_options.influxdb_host)])
-        _cmd_line.extend(
-            ['--influxdb-port', str(self._test_options.influxdb_port)])
-        _cmd_line.extend(
-            ['--logging-level', str(self._test_options.logging_level)])
+        _cmd_line = ['--config-file', None] + self._base_cmd
 
         _args = configuration_parser(_cmd_line)
 
         self.assertEqual(
-            self._test_options.logging_level, _args.logging_level)
+            _TEST_OPTIONS.logging_level, _args.logging_level)
         self.assertEqual(
-            self._test_options.influxdb_host, _args.influxdb_host)
+            _TEST_OPTIONS.influxdb_host, _args.influxdb_host)
         self.assertEqual(
-            self._test_options.influxdb_port, _args.influxdb_port)
+            _TEST_OPTIONS.influxdb_port, _args.influxdb_port)
 
     # ------------------------------------------------------------------------ #
 
@@ -108,25 +123,17 @@ class TestCommandLineParser(unittest.TestCase):
         Tests if the command line options override the settings in the
         configuration file (long options).
         """
-        _cmd_line = []
-
-        _cmd_line.extend(
-            ['--config-file', str(self._config_file)])
-        _cmd_line.extend(
-            ['--influxdb-host', str(self._test_options.influxdb_host)])
-        _cmd_line.extend(
-            ['--influxdb-port', str(self._test_options.influxdb_port)])
-        _cmd_line.extend(
-            ['--logging-level', str(self._test_options.logging_level)])
+        _cmd_line = ['--config-file', '-'] + self._base_cmd
 
-        _args = configuration_parser(_cmd_line)
+        _args = configuration_parser(_cmd_line,
+                                     io.StringIO(self._config_text))
 
         self.assertEqual(
-            self._test_options.logging_level, _args.logging_level)
+            _TEST_OPTIONS.logging_level, _args.logging_level)
         self.assertEqual(
-            self._test_options.influxdb_host, _args.influxdb_host)
+            _TEST_OPTIONS.influxdb_host, _args.influxdb_host)
         self.assertEqual(
-            self._test_options.influxdb_port, _args.influxdb_port)
+            _TEST_OPTIONS.influxdb_port, _args.influxdb_port)
 
     # ------------------------------------------------------------------------ #
 
@@ -135,29 +142,30 @@ class TestCommandLineParser(unittest.TestCase):
         Tests if the command line options override the settings in the
         configuration file (long options).
         """
-        for _opt, _par in COMMANDLINE_PARAMETERS.items():
-            _cmd_line = ['--config-file', str(self._config_file)]
-            _cmd_line.extend([
-                _par['cmdline'],
-                str(getattr(self._test_options, _opt))])
+        _expected = {_cfg: getattr(_TEST_CONFIGURATION, _cfg)
+                     for _cfg in COMMANDLINE_PARAMETERS}
 
-            _args = configuration_parser(_cmd_line)
+        for _opt, _par in COMMANDLINE_PARAMETERS.items():
+            with self.subTest(option=_opt):
+                _cmd_line = ['--config-file', '-']
+                _cmd_line.extend([
+                    _par['cmdline'],
+                    str(getattr(_TEST_OPTIONS, _opt))])
 
-            self.assertEqual(
-                getattr(_args, _opt),
-                getattr(self._test_options, _opt))
+                _args = configuration_parser(_cmd_line,
+                                             io.StringIO(self._config_text))
 
-            for _cfg, _val in COMMANDLINE_PARAMETERS.items():
-                if _cfg == _opt:
-                    continue
                 self.assertEqual(
-                    getattr(_args, _cfg),
-                    getattr(self._test_configuration, _cfg))
-
-    # ------------------------------------------------------------------------ #
+                    getattr(_args, _opt),
+                    getattr(_TEST_OPTIONS, _opt))
 
-    def tearDown(self):
-        os.remove(self._config_file)
+                # The options not given on the command line keep the values
+                # of the configuration file
+                self.assertEqual(
+                    {_cfg: getattr(_args, _cfg)
+                     for _cfg in COMMANDLINE_PARAMETERS if _cfg != _opt},
+                    {_cfg: _expected[_cfg]
+                     for _cfg in COMMANDLINE_PARAMETERS if _cfg != _opt})
 
 # ---------------------------------------------------------------------------- #
 
@@ -168,29 +176,14 @@ class TestGeneralSectionConfigFileParser(unittest.TestCase):
     read and parsed.
     """
 
-    def setUp(self):
-        self._default = Mock()
-        self._default.influxdb_host = INFLUXDB_HOST
-        self._default.influxdb_port = INFLUXDB_PORT
-        self._default.logging_level = logging.INFO
-
-        self._test = Mock()
-        self._test.influxdb_host = 'influxdb_host_test'
-        self._test.influxdb_port = INFLUXDB_PORT + 100
-        self._test.logging_level = logging.INFO + 10
-
-        self._override = Mock()
-        self._override.influxdb_host = 'influxdb_host_override'
-        self._override.influxdb_port = INFLUXDB_PORT + 200
-        self._override.logging_level = logging.INFO + 20
-
-        self._config_file = '/tmp/config.ini'
-        _f = open(self._config_file, "w")
-        _f.write("[GENERAL]\n")
-        _f.write("influxdb_host = {}\n".format(self._test.influxdb_host))
-        _f.write("influxdb_port = {}\n".format(self._test.influxdb_port))
-        _f.write("logging_level = {}\n".format(self._test.logging_level))
-        _f.close()
+    @classmethod
+    def setUpClass(cls):
+        _fd, cls._config_file = tempfile.mkstemp(suffix='.ini')
+        with os.fdopen(_fd, "w", buffering=65536) as _f:
+            _f.write("[GENERAL]\n"
+                     f"influxdb_host = {_TEST.influxdb_host}\n"
+                     f"influxdb_port = {_TEST.influxdb_port}\n"
+                     f"logging_level = {_TEST.logging_level}\n")
 
     # ------------------------------------------------------------------------ #
 
@@ -198,8 +191,8 @@ class TestGeneralSectionConfigFileParser(unittest.TestCase):
         """
         Checks the presence of the GENERAL section in the parser.
         """
-        _cmd_line = []
-        _args = configuration_parser(_cmd_line)
+        _cmd_line = ()
+        _args = _cached_parse(_cmd_line)
 
         self.assertIn('logging_level', _args)
         self.assertIn('influxdb_host', _args)
@@ -211,12 +204,12 @@ class TestGeneralSectionConfigFileParser(unittest.TestCase):
         """
         Checks the defaults of the GENERAL section in the parser.
         """
-        _cmd_line = []
-        _args = configuration_parser(_cmd_line)
+        _cmd_line = ()
+        _args = _cached_parse(_cmd_line)
 
-        self.assertEqual(self._default.logging_level, _args.logging_level)
-        self.assertEqual(self._default.influxdb_host, _args.influxdb_host)
-        self.assertEqual(self._default.influxdb_port, _args.influxdb_port)
+        self.assertEqual(_DEFAULT.logging_level, _args.logging_level)
+        self.assertEqual(_DEFAULT.influxdb_host, _args.influxdb_host)
+        self.assertEqual(_DEFAULT.influxdb_port, _args.influxdb_port)
 
     # ------------------------------------------------------------------------ #
 
@@ -227,9 +220,43 @@ class TestGeneralSectionConfigFileParser(unittest.TestCase):
         _cmd_line = ['-c', self._config_file]
         _args = configuration_parser(_cmd_line)
 
-        self.assertEqual(self._test.logging_level, _args.logging_level)
-        self.assertEqual(self._test.influxdb_host, _args.influxdb_host)
-        self.assertEqual(self._test.influxdb_port, _args.influxdb_port)
+        self.assertEqual(_TEST.logging_level, _args.logging_level)
+        self.assertEqual(_TEST.influxdb_host, _args.influxdb_host)
+        self.assertEqual(_TEST.influxdb_port, _args.influxdb_port)
+
+    # ------------------------------------------------------------------------ #
+
+    def test_general_options_modified(self):
+        """
+        Tests that a modified configuration file is parsed again, both when
+        only its modification time or only its size changes.
+        """
+        _fd, _config_file = tempfile.mkstemp(suffix='.ini')
+        os.close(_fd)
+
+        def _write(host, mtime_ns):
+            with open(_config_file, "w") as _f:
+                _f.write(f"[GENERAL]\ninfluxdb_host = {host}\n")
+            os.utime(_config_file, ns=(mtime_ns, mtime_ns))
+
+        try:
+            _mtime_ns = os.stat(_config_file).st_mtime_ns
+
+            _write('host_a', _mtime_ns)
+            _args = configuration_parser(['-c', _config_file])
+            self.assertEqual('host_a', _args.influxdb_host)
+
+            # Same size, newer modification time
+            _write('host_b', _mtime_ns + 10**9)
+            _args = configuration_parser(['-c', _config_file])
+            self.assertEqual('host_b', _args.influxdb_host)
+
+            # Same modification time, different size
+            _write('host_cc', _mtime_ns + 10**9)
+            _args = configuration_parser(['-c', _config_file])
+            self.assertEqual('host_cc', _args.influxdb_host)
+        finally:
+            os.remove(_config_file)
 
     # ------------------------------------------------------------------------ #
 
@@ -238,44 +265,28 @@ class TestGeneralSectionConfigFileParser(unittest.TestCase):
         Tests if the options in the GENERAL section are overridden by the same
         options in the specific section.
         """
-        _config_specific_override_file = '/tmp/override_config.ini'
-
-        _f = open(_config_specific_override_file, "w")
-        _f.write("[GENERAL]\n")
-        _f.write(
-            "influxdb_host = {}\n".
-            format(self._test.influxdb_host))
-        _f.write(
-            "influxdb_port = {}\n".
-            format(self._test.influxdb_port))
-        _f.write(
-            "logging_level = {}\n".
-            format(self._test.logging_level))
-        _f.write("[{:s}]\n".format(APPLICATION_NAME))
-        _f.write(
-            "influxdb_host = {}\n".
-            format(self._override.influxdb_host))
-        _f.write(
-            "influxdb_port = {}\n".
-            format(self._override.influxdb_port))
-        _f.write(
-            "logging_level = {}\n".
-            format(self._override.logging_level))
-        _f.close()
-
-        _cmd_line = ['-c', _config_specific_override_file]
-        _args = configuration_parser(_cmd_line)
-
-        self.assertEqual(self._override.logging_level, _args.logging_level)
-        self.assertEqual(self._override.influxdb_host, _args.influxdb_host)
-        self.assertEqual(self._override.influxdb_port, _args.influxdb_port)
-
-        os.remove(_config_specific_override_file)
+        _config_text = (
+            "[GENERAL]\n"
+            f"influxdb_host = {_TEST.influxdb_host}\n"
+            f"influxdb_port = {_TEST.influxdb_port}\n"
+            f"logging_level = {_TEST.logging_level}\n"
+            f"[{APPLICATION_NAME}]\n"
+            f"influxdb_host = {_OVERRIDE.influxdb_host}\n"
+            f"influxdb_port = {_OVERRIDE.influxdb_port}\n"
+            f"logging_level = {_OVERRIDE.logging_level}\n")
+
+        _cmd_line = ['-c', '-']
+        _args = configuration_parser(_cmd_line, io.StringIO(_config_text))
+
+        self.assertEqual(_OVERRIDE.logging_level, _args.logging_level)
+        self.assertEqual(_OVERRIDE.influxdb_host, _args.influxdb_host)
+        self.assertEqual(_OVERRIDE.influxdb_port, _args.influxdb_port)
 
     # ------------------------------------------------------------------------ #
 
-    def tearDown(self):
-        os.remove(self._config_file)
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls._config_file)
 
 # ---------------------------------------------------------------------------- #
 
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018-2022, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the parsing of the CSV results returned by InfluxDB, including empty
+    results and statement errors;
+    * the creation of the InfluxDB database when it does not exist;
+    * the body of the report requests sent to the web service;
+    * the bounds of the reported month;
+    * the storage of the report status in the SQLite database.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+
+import reporting
+
+# ---------------------------------------------------------------------------- #
+
+INFLUXDB_PARAMS = {'INFLUXDB_HOST': 'influxdb',
+                   'INFLUXDB_PORT': 8086,
+                   'INFLUXDB_DB': 'Emon',
+                   'INFLUXDB_USER': 'root',
+                   'INFLUXDB_PASS': 'root'}
+
+# ---------------------------------------------------------------------------- #
+
+def _stub_session(body: bytes) -> MagicMock:
+    """
+    Return a stub of the InfluxDB HTTP session answering with "body".
+    """
+    _response = MagicMock()
+    _response.__enter__.return_value = _response
+    _response.raw = io.BytesIO(body)
+    _response.text = body.decode()
+
+    _session = MagicMock()
+    _session.get.return_value = _response
+    _session.post.return_value = _response
+    return _session
+
+# ---------------------------------------------------------------------------- #
+
+class TestQueryCSV(unittest.TestCase):
+    """
+    Checks the parsing of the CSV results of the InfluxDB queries.
+    """
+
+    def _query(self, body):
+        with patch.object(reporting, '_get_influx_session',
+                          return_value=_stub_session(body)):
+            return reporting._query_csv(INFLUXDB_PARAMS, 'SELECT')
+
+    # ------------------------------------------------------------------------ #
+
+    def test_query_csv(self):
+        """
+        Tests that the rows are grouped by measurement and indexed by time.
+        """
+        _result = self._query(b'name,tags,time,power\n'
+                              b'emontx3,,1759276800000,12.5\n'
+                              b'emontx3,,1759280400000,\n')
+
+        self.assertEqual(['emontx3'], list(_result))
+        _y = _result['emontx3']
+        self.assertEqual(['power'], list(_y.columns))
+        self.assertEqual('2025-10-01 00:00:00+00:00', str(_y.index[0]))
+        self.assertEqual('2025-10-01 01:00:00+00:00', str(_y.index[1]))
+        self.assertEqual(12.5, _y['power'].iloc[0])
+        self.assertEqual(1, _y['power'].count())
+
+    # ------------------------------------------------------------------------ #
+
+    def test_query_csv_empty(self):
+        """
+        Tests that an empty result returns no measurements.
+        """
+        self.assertEqual({}, self._query(b''))
+
+    # ------------------------------------------------------------------------ #
+
+    def test_query_csv_error(self):
+        """
+        Tests that a statement error is raised with the message of InfluxDB.
+        """
+        with self.assertRaisesRegex(RuntimeError, 'database not found: Emon'):
+            self._query(b'error\n"database not found: Emon"\n')
+
+# ---------------------------------------------------------------------------- #
+
+class TestCheckInfluxDatabase(unittest.TestCase):
+    """
+    Checks the parsing of the list of InfluxDB databases and the creation of
+    the missing database.
+    """
+
+    def _check(self, body):
+        _session = _stub_session(body)
+        _params = {'LOGGER': logging.getLogger(), **INFLUXDB_PARAMS}
+
+        reporting._DB_CHECKED = False
+        with patch.object(reporting, '_get_influx_session',
+                          return_value=_session):
+            reporting.check_influx_database(_params)
+        return _session
+
+    # ------------------------------------------------------------------------ #
+
+    def test_database_exists(self):
+        """
+        Tests that an existing database is not created again.
+        """
+        _session = self._check(b'name,tags,name\n'
+                               b'databases,,_internal\n'
+                               b'databases,,Emon\n')
+
+        _session.post.assert_not_called()
+        self.assertTrue(reporting._DB_CHECKED)
+
+    # ------------------------------------------------------------------------ #
+
+    def test_database_missing(self):
+        """
+        Tests that a missing database is created.
+        """
+        _session = self._check(b'name,tags,name\n'
+                               b'databases,,_internal\n')
+
+        _session.post.assert_called_once()
+        self.assertEqual('CREATE DATABASE "Emon"',
+                         _session.post.call_args.kwargs['params']['q'])
+        self.assertTrue(reporting._DB_CHECKED)
+
+    # ------------------------------------------------------------------------ #
+
+    def test_database_error(self):
+        """
+        Tests that a statement error is raised with the message of InfluxDB.
+        """
+        with self.assertRaisesRegex(RuntimeError, 'authorization failed'):
+            self._check(b'error\n"authorization failed"\n')
+        self.assertFalse(reporting._DB_CHECKED)
+
+    # ------------------------------------------------------------------------ #
+
+    def tearDown(self):
+        reporting._DB_CHECKED = False
+
+# ---------------------------------------------------------------------------- #
+
+class TestSending(unittest.TestCase):
+    """
+    Checks the body of the report requests sent to the web service.
+    """
+
+    def _send(self, **options):
+        _y = pd.DataFrame({'power': [12.5]},
+                          index=pd.to_datetime([0], unit='ms', utc=True))
+        _params = {'LOGGER': logging.getLogger(),
+                   'WEB_SERVER_URL': 'https://example.com/get_report',
+                   'EMAIL_ADDRESS': 'username@example.com',
+                   'NESTED_REPORT_DATA': False,
+                   'COMPRESS_REPORT_REQUEST': False}
+        _params.update(options)
+
+        _session = MagicMock()
+        with patch.object(reporting, '_get_session', return_value=_session):
+            reporting.sending(_y, _params)
+
+        _kwargs = _session.post.call_args.kwargs
+        _data = _kwargs['data']
+        if _params['COMPRESS_REPORT_REQUEST']:
+            self.assertEqual('gzip', _kwargs['headers']['Content-Encoding'])
+            _data = gzip.decompress(_data)
+        else:
+            self.assertNotIn('Content-Encoding', _kwargs['headers'])
+        return json.loads(_data)
+
+    # ------------------------------------------------------------------------ #
+
+    def test_sending_string_data(self):
+        """
+        Tests that by default the data are sent as a JSON string.
+        """
+        _body = self._send()
+
+        self.assertEqual('username@example.com', _body['email_address'])
+        self.assertEqual({'power': {'0': 12.5}}, json.loads(_body['data']))
+
+    # ------------------------------------------------------------------------ #
+
+    def test_sending_nested_data(self):
+        """
+        Tests that the data are sent as a nested JSON object when requested.
+        """
+        _body = self._send(NESTED_REPORT_DATA=True)
+
+        self.assertEqual('username@example.com', _body['email_address'])
+        self.assertEqual({'power': {'0': 12.5}}, _body['data'])
+
+    # ------------------------------------------------------------------------ #
+
+    def test_sending_compressed(self):
+        """
+        Tests that the body is gzipped when requested.
+        """
+        _body = self._send(COMPRESS_REPORT_REQUEST=True)
+
+        self.assertEqual('username@example.com', _body['email_address'])
+        self.assertEqual({'power': {'0': 12.5}}, json.loads(_body['data']))
+
+# ---------------------------------------------------------------------------- #
+
+class TestReportPeriod(unittest.TestCase):
+    """
+    Checks the bounds of the month covered by the report.
+    """
+
+    def setUp(self):
+        self._tz = os.environ.get('TZ')
+
+    # ------------------------------------------------------------------------ #
+
+    def _set_timezone(self, tz):
+        if tz is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = tz
+        time.tzset()
+
+    # ------------------------------------------------------------------------ #
+
+    def test_previous_month_bounds(self):
+        """
+        Tests that the bounds are the first days of the previous and of the
+        current month, across the turn of the year too.
+        """
+        _cases = [
+            (date(2026, 1, 15), (date(2025, 12, 1), date(2026, 1, 1))),
+            (date(2026, 3, 1), (date(2026, 2, 1), date(2026, 3, 1))),
+        ]
+        for _today, _expected in _cases:
+            class _FixedDate(date):
+                @classmethod
+                def today(cls, _today=_today):
+                    return _today
+
+            with patch('reporting.date', _FixedDate):
+                self.assertEqual(_expected,
+                                 reporting.get_previous_month_bounds())
+
+    # ------------------------------------------------------------------------ #
+
+    def test_local_midnight_utc(self):
+        """
+        Tests that the local midnight is converted to UTC.
+        """
+        # POSIX TZ strings do not need the zoneinfo database in the image
+        self._set_timezone('UTC0')
+        self.assertEqual('2026-09-01T00:00:00Z',
+                         reporting._local_midnight_utc(date(2026, 9, 1)))
+
+        self._set_timezone('CET-1CEST,M3.5.0,M10.5.0/3')
+        self.assertEqual('2026-08-31T22:00:00Z',
+                         reporting._local_midnight_utc(date(2026, 9, 1)))
+        self.assertEqual('2026-11-30T23:00:00Z',
+                         reporting._local_midnight_utc(date(2026, 12, 1)))
+
+    # ------------------------------------------------------------------------ #
+
+    def tearDown(self):
+        self._set_timezone(self._tz)
+
+# ---------------------------------------------------------------------------- #
+
+class TestReportStatus(unittest.TestCase):
+    """
+    Checks the storage of the report status in a temporary SQLite database.
+    """
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._params = {'LOGGER': logging.getLogger(),
+                        'SQLITE_DB': os.path.join(self._tmp_dir.name,
+                                                  'reporting.db'),
+                        'SQLITE_DB_TABLE': 'report_requests'}
+
+        reporting._TABLE_READY = False
+        reporting.create_sqlite_table(self._params)
+
+    # ------------------------------------------------------------------------ #
+
+    def test_update_sqlite_db(self):
+        """
+        Tests that only a successful report is marked as received.
+        """
+        _month_start = date(2026, 9, 1)
+
+        reporting.update_sqlite_db(self._params, '2026-09', 500)
+        self.assertEqual(
+            (False, '2026-09'),
+            reporting.check_report_status(self._params, _month_start))
+
+        reporting.update_sqlite_db(self._params, '2026-09', 200)
+        self.assertEqual(
+            (True, '2026-09'),
+            reporting.check_report_status(self._params, _month_start))
+
+    # ------------------------------------------------------------------------ #
+
+    def test_update_sqlite_db_many(self):
+        """
+        Tests that several records are inserted at once.
+        """
+        reporting.update_sqlite_db_many(
+            self._params, ((f'2026-{_m:02d}', 200) for _m in range(1, 4)))
+
+        for _m in range(1, 4):
+            self.assertTrue(reporting.check_report_status(
+                self._params, date(2026, _m, 1))[0])
+        self.assertFalse(reporting.check_report_status(
+            self._params, date(2026, 4, 1))[0])
+
+    # ------------------------------------------------------------------------ #
+
+    def tearDown(self):
+        reporting._get_conn(self._params['SQLITE_DB']).close()
+        reporting._get_conn.cache_clear()
+        reporting._TABLE_READY = False
+        self._tmp_dir.cleanup()
+
+# ---------------------------------------------------------------------------- #
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ---------------------------------------------------------------------------- #